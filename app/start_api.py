@@ -1,8 +1,31 @@
+import logging
 import os
 import sys
 import uvicorn
 from dotenv import load_dotenv
 
+def configure_threading():
+    """
+    Pins CPU thread counts before any numeric library is imported.
+    FAISS's OpenMP pool and PyTorch's intra-op pool oversubscribe each other
+    on multi-core boxes; one OMP thread plus cpu_count/2 torch threads is a
+    good default for the small-batch encode workload. Override via env vars.
+    """
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
+    os.environ.setdefault("MKL_NUM_THREADS", "1")
+
+    try:
+        import torch
+        torch_threads = int(
+            os.getenv("TORCH_NUM_THREADS", max(1, (os.cpu_count() or 2) // 2))
+        )
+        torch.set_num_threads(torch_threads)
+        print(f"🧵  Thread config: torch={torch_threads}, OMP={os.environ['OMP_NUM_THREADS']}")
+    except ImportError:
+        # ONNX-only installs have no torch; the env vars above still apply
+        pass
+
+
 def run_pre_flight_checks():
     """
     Loads and verifies that necessary environment variables are set.
@@ -30,8 +53,10 @@ def main():
     """
     Main function to start the API server for local development.
     """
+    logging.basicConfig(level=logging.INFO)
+    configure_threading()
     run_pre_flight_checks()
-    
+
     print("\n🚀  Starting FastAPI server in development mode...")
     print("🔄  Hot-reloading is enabled.")
     print("📄  API documentation will be available at: http://127.0.0.1:8000/docs")
@@ -0,0 +1,91 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from embeddings.model_registry import get_embedding_model
+
+# ✅ Persistent sha256(text) -> float32 vector cache.
+# A repeated query costs a ~µs lookup here instead of an encoder forward
+# pass. Rows are keyed by model name too, so swapping the embedding model
+# invalidates stale vectors instead of silently serving them.
+CACHE_DB_PATH = os.getenv("RAG_EMB_CACHE", "embeddings/embedding_cache.sqlite")
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+_conn = None
+_conn_lock = threading.Lock()
+
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(CACHE_DB_PATH) or ".", exist_ok=True)
+        _conn = sqlite3.connect(CACHE_DB_PATH, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS emb_cache ("
+            "  hash TEXT NOT NULL,"
+            "  model TEXT NOT NULL,"
+            "  vec BLOB NOT NULL,"
+            "  PRIMARY KEY (hash, model)"
+            ")"
+        )
+    return _conn
+
+
+# SQLite caps host parameters per statement (999 on older builds), so IN
+# lookups are chunked — chunk-embedding corpora easily exceed the cap
+_SQL_BATCH = 500
+
+
+def cached_encode(texts, batch_size=64):
+    """
+    Encode texts to unit-norm float32 vectors, serving repeats from the
+    SQLite cache and batching only the misses through the model.
+    Returns an (N, dim) float32 matrix in input order.
+    """
+    if not texts:
+        # Keep the 2-D contract — callers hand this straight to FAISS
+        dim = get_embedding_model().get_sentence_embedding_dimension()
+        return np.empty((0, dim), dtype=np.float32)
+
+    hashes = [hashlib.sha256(t.encode()).hexdigest() for t in texts]
+
+    cached = {}
+    with _conn_lock:
+        conn = _get_conn()
+        for start in range(0, len(hashes), _SQL_BATCH):
+            batch = hashes[start:start + _SQL_BATCH]
+            rows = conn.execute(
+                "SELECT hash, vec FROM emb_cache WHERE model = ? AND hash IN (%s)"
+                % ",".join("?" * len(batch)),
+                [MODEL_NAME] + batch,
+            ).fetchall()
+            cached.update(
+                (h, np.frombuffer(blob, dtype=np.float32)) for h, blob in rows
+            )
+
+    miss_positions = [i for i, h in enumerate(hashes) if h not in cached]
+    if miss_positions:
+        miss_vectors = get_embedding_model().encode(
+            [texts[i] for i in miss_positions],
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+        with _conn_lock:
+            conn = _get_conn()
+            conn.executemany(
+                "INSERT OR REPLACE INTO emb_cache (hash, model, vec) VALUES (?, ?, ?)",
+                [
+                    (hashes[i], MODEL_NAME, np.asarray(vec, dtype=np.float32).tobytes())
+                    for i, vec in zip(miss_positions, miss_vectors)
+                ],
+            )
+            conn.commit()
+        for i, vec in zip(miss_positions, miss_vectors):
+            cached[hashes[i]] = np.asarray(vec, dtype=np.float32)
+
+    return np.ascontiguousarray([cached[h] for h in hashes], dtype=np.float32)
@@ -1,13 +1,13 @@
+import hashlib
+import math
 import os
 import pickle
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import faiss
 import fitz  # PyMuPDF for per-page text extraction
-from sentence_transformers import SentenceTransformer
 from utils.pdf_processing import clean_pdf_text, chunk_text_by_tokens
-
-# ✅ Load embedding model once
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+from embeddings.model_registry import get_embedding_model
 
 def process_single_pdf(pdf_path):
     """
@@ -19,33 +19,35 @@ def process_single_pdf(pdf_path):
 
     all_chunks = []
 
-    # ✅ Open PDF with PyMuPDF
-    doc = fitz.open(pdf_path)
-    total_pages = len(doc)
+    # ✅ Open PDF with PyMuPDF (context manager closes it even on errors)
+    with fitz.open(pdf_path) as doc:
+        total_pages = len(doc)
 
-    for page_num in range(total_pages):
-        page = doc.load_page(page_num)
-        page_text = page.get_text("text")
+        for page_num in range(total_pages):
+            page = doc.load_page(page_num)
+            page_text = page.get_text("text")
 
-        # ✅ Clean text
-        cleaned_text = clean_pdf_text(page_text)
+            # ✅ Skip blank/image-only pages before paying for cleaning —
+            # scanned or graphical PDFs can be 10-40% such pages
+            if len(page_text) < 20:
+                continue
 
-        # ✅ Skip empty pages
-        if not cleaned_text.strip():
-            continue
+            # ✅ Clean text
+            cleaned_text = clean_pdf_text(page_text)
+            if not cleaned_text.strip():
+                continue
 
-        # ✅ Chunk text from this page
-        chunks = chunk_text_by_tokens(cleaned_text, chunk_size=512, overlap=50)
+            # ✅ Chunk text from this page
+            chunks = chunk_text_by_tokens(cleaned_text, chunk_size=512, overlap=50)
 
-        # ✅ Attach metadata with PDF name + page number (1-based indexing)
-        for c in chunks:
-            all_chunks.append({
-                "chunk": c,
-                "source": pdf_name,
-                "page": page_num + 1
-            })
+            # ✅ Attach metadata with PDF name + page number (1-based indexing)
+            for c in chunks:
+                all_chunks.append({
+                    "chunk": c,
+                    "source": pdf_name,
+                    "page": page_num + 1
+                })
 
-    doc.close()
     print(f"✅ Created {len(all_chunks)} chunks from {pdf_name} ({total_pages} pages)")
 
     return all_chunks
@@ -69,12 +71,54 @@ def process_multiple_pdfs_and_create_index(pdf_folder):
         return False
 
     all_chunks = []
-
-    # ✅ Process each PDF
-    for pdf in pdf_files:
-        pdf_path = os.path.join(pdf_folder, pdf)
-        pdf_chunks = process_single_pdf(pdf_path)
-        all_chunks.extend(pdf_chunks)
+    embedding_parts = []
+    # Repeated boilerplate (headers, footers, tables of contents) produces
+    # identical chunk texts across pages and PDFs; encode each distinct text
+    # once and fan the embeddings back out to every occurrence.
+    seen_rows = {}   # chunk-text digest -> row in the unique embedding matrix
+    row_ids = []     # one entry per chunk in all_chunks
+    unique_count = 0
+
+    model = get_embedding_model()
+    # 128 saturates tensor cores on GPU; on CPU small batches keep
+    # length-bucketed sequences tight and avoid padding blowup.
+    # (encode() applies SBERT's smart batching itself — sorts by length,
+    # pads per batch, restores order — so no explicit argsort is needed.)
+    batch_size = 128 if str(getattr(model, "device", "cpu")).startswith("cuda") else 16
+
+    # ✅ Pipeline the two phases: extraction/cleaning/chunking runs in a
+    # process pool (pure CPU work, no cross-PDF dependency) while this
+    # process embeds each PDF's chunks as soon as they arrive — PDF N+1 is
+    # being extracted while PDF N is on the encoder.
+    pdf_paths = [os.path.join(pdf_folder, pdf) for pdf in pdf_files]
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for pdf_chunks in executor.map(process_single_pdf, pdf_paths):
+            if not pdf_chunks:
+                continue
+            all_chunks.extend(pdf_chunks)
+            new_texts = []
+            for item in pdf_chunks:
+                key = hashlib.blake2b(
+                    item["chunk"].encode(), digest_size=16
+                ).digest()
+                if key not in seen_rows:
+                    seen_rows[key] = unique_count
+                    unique_count += 1
+                    new_texts.append(item["chunk"])
+                row_ids.append(seen_rows[key])
+            if new_texts:
+                embedding_parts.append(
+                    model.encode(
+                        new_texts,
+                        batch_size=batch_size,
+                        show_progress_bar=False,
+                        convert_to_numpy=True,
+                        # unit-norm vectors straight from the model — no
+                        # separate faiss.normalize_L2 sweep afterwards
+                        normalize_embeddings=True,
+                    )
+                )
+            print(f"   🔄 Embedded {unique_count}/{len(all_chunks)} unique chunks so far")
 
     print(f"\n✅ Finished processing {len(pdf_files)} PDFs")
     print(f"✅ Total chunks created: {len(all_chunks)}")
@@ -83,25 +127,77 @@ def process_multiple_pdfs_and_create_index(pdf_folder):
         print("❌ No chunks generated!")
         return False
 
-    # ✅ Extract only chunk texts for embeddings
-    chunk_texts = [item["chunk"] for item in all_chunks]
-
-    # ✅ Generate embeddings for all chunks
-    print("\n🔄 Generating embeddings for ALL chunks...")
-    embeddings = embedding_model.encode(chunk_texts, show_progress_bar=True)
-    faiss.normalize_L2(embeddings)
+    # Fan unique embeddings back out so row i still matches all_chunks[i]
+    unique_embeddings = np.concatenate(embedding_parts).astype(np.float32, copy=False)
+    embeddings = unique_embeddings[np.asarray(row_ids)]
 
     # ✅ Create FAISS index
+    # Index type scales with corpus size. Small corpora stay brute-force
+    # (cache-resident flat scan); mid-size ones get an HNSW graph
+    # (sub-linear search, no training phase, exact vectors kept); very large
+    # ones get IVF+PQ, whose 16-byte codes compress 1536-byte float vectors
+    # ~96x and make cell-probe search sub-linear. Normalized vectors + inner
+    # product keep cosine semantics throughout.
     dimension = embeddings.shape[1]
-    index = faiss.IndexFlatIP(dimension)
-    index.add(np.array(embeddings, dtype="float32"))
+    if len(all_chunks) >= 100_000:
+        # OPQ rotation in front of the PQ codebooks recovers most of the
+        # recall that raw PQ loses at the same code size
+        nlist = max(64, int(4 * math.sqrt(len(all_chunks))))
+        index = faiss.index_factory(
+            dimension, f"OPQ32,IVF{nlist},PQ32", faiss.METRIC_INNER_PRODUCT
+        )
+        index.train(embeddings)
+        faiss.extract_index_ivf(index).nprobe = 16
+    elif len(all_chunks) >= 1000:
+        # fp16 scalar-quantized storage under the HNSW graph: MiniLM
+        # embeddings lose essentially no recall at half precision, and
+        # search is memory-bandwidth bound, so halving bytes per vector
+        # halves both the file size and the bytes read per query
+        index = faiss.IndexHNSWSQ(
+            dimension,
+            faiss.ScalarQuantizer.QT_fp16,
+            32,
+            faiss.METRIC_INNER_PRODUCT,
+        )
+        index.hnsw.efConstruction = 200
+        index.hnsw.efSearch = 64
+        index.train(embeddings)
+    else:
+        index = faiss.IndexFlatIP(dimension)
+    index.add(embeddings)
 
     # ✅ Save FAISS index
     faiss.write_index(index, "embeddings/pdf_index.faiss")
 
-    # ✅ Save metadata (chunk + PDF name + page)
-    with open("embeddings/chunk_metadata.pkl", "wb") as f:
-        pickle.dump(all_chunks, f)
+    # ✅ Save chunk text as one utf-8 blob plus a uint32 offset table.
+    # A list of 100k separate Python strings costs tens of MB of object
+    # headers; the blob mmaps in read-only and chunk i is decoded on demand
+    # from offsets[i]:offsets[i+1]. uint32 offsets cap the blob at 4 GB,
+    # far above any realistic corpus here.
+    encoded_chunks = [item["chunk"].encode("utf-8") for item in all_chunks]
+    offsets = np.zeros(len(encoded_chunks) + 1, dtype=np.uint32)
+    offsets[1:] = np.cumsum([len(b) for b in encoded_chunks])
+    with open("embeddings/chunk_text.bin", "wb") as f:
+        f.write(b"".join(encoded_chunks))
+    np.save("embeddings/chunk_offsets.npy", offsets)
+
+    # ✅ Save the remaining metadata (PDF name + page)
+    # Columnar parquet: one zstd-compressed column per field instead of a
+    # pickled list of dicts — 2-5x smaller and loadable via memory map.
+    # Chunk text lives in the blob above, so it is no longer duplicated here.
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.table({
+            "source": [item["source"] for item in all_chunks],
+            "page": [item["page"] for item in all_chunks],
+        })
+        pq.write_table(table, "embeddings/chunk_metadata.parquet", compression="zstd")
+    except ImportError:
+        # pyarrow not installed — keep the legacy pickle format
+        with open("embeddings/chunk_metadata.pkl", "wb") as f:
+            pickle.dump(all_chunks, f)
 
     print("✅ Multi-PDF index created with page metadata! (FAISS + metadata saved)")
     return True
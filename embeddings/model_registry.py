@@ -0,0 +1,75 @@
+import logging
+
+from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+# ✅ Single shared model instance for the whole process.
+# rag_pipeline, query_retriever, and generate_embeddings all used to load
+# their own copy of all-MiniLM-L6-v2 (~90 MB of weights each); every module
+# now goes through this registry instead.
+_embedding_model = None
+
+
+def _detect_device():
+    """Picks the fastest available torch device: cuda, then mps, then cpu."""
+    try:
+        import torch
+
+        if torch.cuda.is_available():
+            return "cuda"
+        if torch.backends.mps.is_available():
+            return "mps"
+    except (ImportError, AttributeError):
+        pass
+    return "cpu"
+
+
+def get_embedding_model():
+    """
+    Loads the embedding model once and reuses it for every request.
+    On GPU/MPS hosts the PyTorch backend runs on the accelerator; on CPU it
+    prefers the ONNX int8 backend (VNNI dot products, ~2-4x faster), falling
+    back to PyTorch if onnxruntime is unavailable.
+    """
+    global _embedding_model
+    if _embedding_model is None:
+        device = _detect_device()
+        if device != "cpu":
+            _embedding_model = SentenceTransformer(
+                "all-MiniLM-L6-v2", device=device
+            )
+            if device == "cuda":
+                # FP16 halves memory bandwidth and roughly doubles
+                # throughput on tensor-core GPUs; MiniLM tolerates it
+                _embedding_model.half()
+            # MiniLM ships with 256 already, but pin it so a config change
+            # upstream can't silently quadruple the attention cost
+            _embedding_model.max_seq_length = 256
+            logger.info("✅ Loaded embedding model on %s.", device)
+            return _embedding_model
+        try:
+            _embedding_model = SentenceTransformer(
+                "all-MiniLM-L6-v2",
+                backend="onnx",
+                model_kwargs={"file_name": "onnx/model_qint8_avx512_vnni.onnx"},
+            )
+            logger.info("✅ Loaded embedding model with ONNX int8 backend.")
+        except Exception as e:
+            logger.warning("⚠ ONNX backend unavailable (%s), falling back to PyTorch.", e)
+            _embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+            try:
+                import torch
+
+                # Fuse the transformer forward pass; warm up on a dummy
+                # string so the first real request doesn't pay compile cost.
+                _embedding_model[0].auto_model = torch.compile(
+                    _embedding_model[0].auto_model,
+                    mode="reduce-overhead",
+                    fullgraph=False,
+                )
+                _embedding_model.encode(["warmup"], show_progress_bar=False)
+                logger.info("✅ Compiled PyTorch embedding model (reduce-overhead).")
+            except Exception as e:
+                logger.warning("⚠ torch.compile unavailable (%s), using eager mode.", e)
+    return _embedding_model
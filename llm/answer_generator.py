@@ -1,40 +1,63 @@
+import hashlib
+import json
 import re
-from openai import OpenAI
-from retriever.query_retriever import load_faiss_and_metadata, retrieve_top_k_chunks
+import threading
+import time
+from collections import OrderedDict
 
-# ✅ Initialize OpenAI client
+from openai import AsyncOpenAI, OpenAI
+from retriever.query_retriever import (
+    load_faiss_and_metadata,
+    retrieve_top_k_chunks,
+    retrieve_top_k_chunks_batch,
+)
+
+# ✅ Initialize OpenAI clients (sync for the CLI, async for the API path)
 client = OpenAI()
+async_client = AsyncOpenAI()
 
 # ✅ --- Helper: Build context ---
 def build_context_from_chunks(results):
     """
     Build context string from retrieved chunks with source & page
     """
-    context = ""
-    for r in results:
-        context += f"\n[From {r['source']} (Page {r['page']})]\n{r['chunk']}\n"
-    return context
+    # List-append + single join is linear; repeated += on a string is O(N²)
+    parts = [
+        f"\n[From {r['source']} (Page {r['page']})]\n{r['chunk']}\n"
+        for r in results
+    ]
+    return "".join(parts)
 
 
 # ✅ --- Helper: Detect filters from query ---
+# Compiled once at import instead of on every query
+_PAGE_RANGE_RE = re.compile(r"pages?\s+(\d+)\s*-\s*(\d+)", re.IGNORECASE)
+_PAGE_SINGLE_RE = re.compile(r"page\s+(\d+)", re.IGNORECASE)
+
+
 def parse_query_filters(query, all_pdf_names):
     """
     Try to extract PDF name and page range from the query.
+    all_pdf_names may be plain names or pre-lowered (name, short_low) pairs.
     Returns (pdf_name, page_range) or (None, None) if not found.
     """
     pdf_name = None
     page_range = None
 
-    # ✅ 1. Detect PDF name from query
-    for name in all_pdf_names:
-        short_name = name.replace(".pdf", "")
-        if short_name.lower() in query.lower():
+    # ✅ 1. Detect PDF name from query (query lowered once, not per name)
+    query_low = query.lower()
+    for entry in all_pdf_names:
+        if isinstance(entry, tuple):
+            name, short_low = entry
+        else:
+            name, short_low = entry, entry.replace(".pdf", "").lower()
+        if short_low in query_low:
             pdf_name = name
             break
 
     # ✅ 2. Detect page numbers like "page 1" or "pages 5-10"
-    match_range = re.search(r"pages?\s+(\d+)\s*-\s*(\d+)", query, re.IGNORECASE)
-    match_single = re.search(r"page\s+(\d+)", query, re.IGNORECASE)
+    match_range = _PAGE_RANGE_RE.search(query)
+    match_single = _PAGE_SINGLE_RE.search(query)
 
     if match_range:
         start, end = int(match_range.group(1)), int(match_range.group(2))
@@ -47,30 +70,205 @@ def parse_query_filters(query, all_pdf_names):
 
 
 # ✅ --- GPT Answer Generator ---
-def generate_answer_with_gpt(chat_history, query, context):
-    """
-    Ask GPT with retrieved context + previous chat history
-    """
-    # System prompt
+# Generation knobs: every decoded token costs latency linearly, so cap the
+# answer length; low temperature suits extractive document QA
+GENERATION_KWARGS = {
+    "model": "gpt-4o-mini",
+    "max_tokens": 400,
+    "temperature": 0.2,
+    "stop": ["\n\nQuestion:"],
+}
+
+
+# ✅ LRU cache for repeated (query, context) pairs — evals and API requests
+# often re-ask identical questions against the same document, and a cache
+# hit skips a full LLM round-trip. Only history-free calls are cached:
+# chat history changes the answer. GPT calls are deterministic enough at
+# temperature 0.2 for repeat answers to be interchangeable.
+_ANSWER_CACHE_MAX = 1024
+_answer_cache = OrderedDict()
+_answer_cache_lock = threading.Lock()
+
+
+def _answer_cache_key(query, context):
+    return hashlib.sha256(f"{query}\x00{context}".encode()).hexdigest()
+
+
+def _answer_cache_get(key):
+    with _answer_cache_lock:
+        if key not in _answer_cache:
+            return None
+        _answer_cache.move_to_end(key)
+        return _answer_cache[key]
+
+
+def _answer_cache_put(key, answer):
+    with _answer_cache_lock:
+        _answer_cache[key] = answer
+        _answer_cache.move_to_end(key)
+        while len(_answer_cache) > _ANSWER_CACHE_MAX:
+            _answer_cache.popitem(last=False)
+
+
+def _build_messages(chat_history, query, context):
+    """Assemble the message list shared by the sync and async generators."""
+    # The "context only" rule lives in the system message once instead of
+    # being repeated (and re-tokenized) in every user turn
     messages = [
-        {"role": "system", "content": "You are a helpful assistant that ONLY answers using the provided context."}
+        {"role": "system", "content": "Answer using ONLY the provided context."}
     ]
 
-    # Add chat history
-    messages.extend(chat_history)
+    # Add chat history — only the last 4 exchanges; older turns just inflate
+    # tokens re-serialized and re-sent on every call in long sessions
+    messages.extend(chat_history[-8:])
 
     # Add user query with context
     messages.append({
         "role": "user",
-        "content": f"Context:\n{context}\n\nQuestion: {query}\nAnswer using ONLY the context above."
+        "content": f"Context:\n{context}\n\nQuestion: {query}"
     })
+    return messages
+
+
+def generate_answer_with_gpt(chat_history, query, context, stream=False):
+    """
+    Ask GPT with retrieved context + previous chat history.
+    With stream=True, tokens are printed as they arrive (sub-second time
+    to first token in the CLI) and the full answer is still returned.
+    """
+    cache_key = None
+    if not chat_history:
+        cache_key = _answer_cache_key(query, context)
+        cached = _answer_cache_get(cache_key)
+        if cached is not None:
+            if stream:
+                print(cached)
+            return cached
+
+    messages = _build_messages(chat_history, query, context)
 
     # Call GPT
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages
+    if stream:
+        pieces = []
+        response = client.chat.completions.create(
+            messages=messages,
+            stream=True,
+            **GENERATION_KWARGS
+        )
+        for chunk in response:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                pieces.append(delta)
+                print(delta, end="", flush=True)
+        print()
+        answer = "".join(pieces)
+    else:
+        response = client.chat.completions.create(
+            messages=messages,
+            **GENERATION_KWARGS
+        )
+        answer = response.choices[0].message.content
+
+    if cache_key is not None:
+        _answer_cache_put(cache_key, answer)
+    return answer
+
+
+async def generate_answer_with_gpt_async(chat_history, query, context):
+    """
+    Async variant for the API path — lets many questions overlap network
+    and inference latency instead of tying up a worker thread each.
+    """
+    cache_key = None
+    if not chat_history:
+        cache_key = _answer_cache_key(query, context)
+        cached = _answer_cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+    response = await async_client.chat.completions.create(
+        messages=_build_messages(chat_history, query, context),
+        **GENERATION_KWARGS
     )
-    return response.choices[0].message.content
+    answer = response.choices[0].message.content
+    if cache_key is not None:
+        _answer_cache_put(cache_key, answer)
+    return answer
+
+
+# ✅ --- Offline batch answering (eval sweeps) ---
+def generate_answers_batch(queries, k=3, poll_interval=30):
+    """
+    Answer many questions offline through the OpenAI Batch API — ~50%
+    cheaper than live Chat Completions and rate-limited separately, so
+    large eval sweeps don't compete with interactive traffic. Retrieval
+    runs locally in one batched encode + FAISS search; only the LLM calls
+    go through the batch queue. Blocks until the batch finishes (up to the
+    24h completion window) and returns answers in input order.
+    """
+    faiss_index, chunk_metadata = load_faiss_and_metadata()
+    all_results = retrieve_top_k_chunks_batch(
+        queries, faiss_index, chunk_metadata, k=k
+    )
+
+    # One JSONL request line per question, tagged with its position so the
+    # (unordered) results file can be mapped back to input order
+    lines = [
+        json.dumps({
+            "custom_id": f"q-{i}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "messages": _build_messages(
+                    [], query, build_context_from_chunks(results)
+                ),
+                **GENERATION_KWARGS,
+            },
+        })
+        for i, (query, results) in enumerate(zip(queries, all_results))
+    ]
+    payload = ("\n".join(lines) + "\n").encode("utf-8")
+
+    batch_file = client.files.create(
+        file=("rag_eval_batch.jsonl", payload), purpose="batch"
+    )
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    print(f"📦 Submitted batch {batch.id} with {len(queries)} questions")
+
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+        print(f"⏳ Batch {batch.id}: {batch.status}")
+    if batch.status != "completed":
+        raise RuntimeError(f"Batch {batch.id} ended with status: {batch.status}")
+
+    # Failed items carry "response": null plus an "error" object — one bad
+    # question must not throw away a sweep that just waited on the queue
+    answers = [None] * len(queries)
+    errors = {}
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        position = int(record["custom_id"].split("-", 1)[1])
+        response = record.get("response")
+        if response and response.get("status_code", 200) == 200:
+            answers[position] = (
+                response["body"]["choices"][0]["message"]["content"]
+            )
+        else:
+            errors[position] = record.get("error") or response
+
+    missing = [i for i, answer in enumerate(answers) if answer is None]
+    if missing:
+        print(f"⚠ {len(missing)} question(s) got no answer: positions {missing}")
+        for i in missing:
+            answers[i] = f"[batch error: {errors.get(i, 'no output line returned')}]"
+    return answers
 
 
 # ✅ --- Interactive Q&A ---
@@ -84,8 +282,10 @@ def interactive_qa():
     faiss_index, chunk_metadata = load_faiss_and_metadata()
     print("\n✅ Multi-PDF QA ready! Type 'exit' to quit.\n")
 
-    # Collect available PDF names
+    # Collect available PDF names (lowered short names precomputed once
+    # for the per-query filter detection)
     all_pdf_names = list({m["source"] for m in chunk_metadata})
+    pdf_name_pairs = [(n, n.replace(".pdf", "").lower()) for n in all_pdf_names]
     print(f"📂 Available PDFs: {', '.join(all_pdf_names)}")
 
     chat_history = []
@@ -97,7 +297,7 @@ def interactive_qa():
             break
 
         # ✅ Detect filters in query
-        pdf_name, page_range = parse_query_filters(query, all_pdf_names)
+        pdf_name, page_range = parse_query_filters(query, pdf_name_pairs)
         if pdf_name:
             print(f"🎯 Detected PDF filter → {pdf_name}")
         if page_range:
@@ -120,18 +320,17 @@ def interactive_qa():
         else:
             print("\n⚠ No relevant chunks found with given filters.")
 
-        # ✅ Build GPT context & generate answer
+        # ✅ Build GPT context & stream the answer token by token
         context = build_context_from_chunks(results)
-        answer = generate_answer_with_gpt(chat_history, query, context)
-
-        # ✅ Show GPT answer
         print("\n🤖 Answer:")
-        print(answer)
+        answer = generate_answer_with_gpt(chat_history, query, context, stream=True)
         print("\n" + "-"*50)
 
-        # ✅ Save chat history for follow-up questions
+        # ✅ Save chat history for follow-up questions (rolling window so a
+        # multi-hour session doesn't grow the list without bound)
         chat_history.append({"role": "user", "content": query})
         chat_history.append({"role": "assistant", "content": answer})
+        chat_history = chat_history[-16:]
 
 
 # ✅ Run standalone
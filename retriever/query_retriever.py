@@ -1,85 +1,297 @@
+import os
 import pickle
+from collections import OrderedDict
+
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from embeddings.embedding_cache import cached_encode
+
+# ✅ Thread pools: RAG_THREADS pins both FAISS's OpenMP pool and torch's
+# intra-op pool for standalone CLI/eval runs. Opt-in only — the API server
+# already pins its pools in start_api.py and must not be overridden here.
+_rag_threads = int(os.getenv("RAG_THREADS", 0))
+if _rag_threads > 0:
+    faiss.omp_set_num_threads(_rag_threads)
+    try:
+        import torch
+        torch.set_num_threads(_rag_threads)
+    except ImportError:
+        pass
 
 # ✅ Paths
 FAISS_PATH = "embeddings/pdf_index.faiss"
+METADATA_PARQUET_PATH = "embeddings/chunk_metadata.parquet"
 METADATA_PATH = "embeddings/chunk_metadata.pkl"
+TEXT_BLOB_PATH = "embeddings/chunk_text.bin"
+TEXT_OFFSETS_PATH = "embeddings/chunk_offsets.npy"
+
+
+class ChunkMetadata:
+    """
+    Sequence view over the columnar metadata files written at index time.
+    Chunk text stays in one mmapped utf-8 blob sliced by a uint32 offset
+    table — no per-chunk Python string object exists until a search result
+    actually asks for its text, so a 100k-chunk corpus loads with near-zero
+    heap cost. Indexing yields the same {chunk, source, page} dicts the
+    rest of the pipeline expects.
+
+    Structures derived for filtered search (the per-source inverted index
+    and FAISS ID selectors) live on the instance, so their lifetime matches
+    the metadata they describe and they are dropped together with it.
+    """
+
+    # Identical filters repeat within a session, but a long multi-corpus
+    # run must not accumulate selectors without bound
+    _SELECTOR_CACHE_MAX = 128
+
+    def __init__(self, text_blob, offsets, sources, pages):
+        self._blob = text_blob
+        self._offsets = offsets
+        self.sources = sources
+        self.pages = pages
+        self._by_source = None
+        self._selector_cache = OrderedDict()
+
+    @classmethod
+    def from_records(cls, records):
+        """Builds the SoA layout in memory from legacy {chunk, source, page} dicts."""
+        encoded = [r["chunk"].encode("utf-8") for r in records]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+        return cls(
+            np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            offsets,
+            np.array([r["source"] for r in records]),
+            np.array([r["page"] for r in records], dtype=np.int32),
+        )
+
+    def source_row_ids(self):
+        """Returns the source -> int64 row-id inverted index, built once."""
+        if self._by_source is None:
+            self._by_source = {
+                name: np.nonzero(self.sources == name)[0].astype(
+                    np.int64, copy=False
+                )
+                for name in np.unique(self.sources)
+            }
+        return self._by_source
+
+    def selector(self, filter_key, allowed):
+        """Returns an LRU-cached IDSelectorBatch for a repeated filter."""
+        sel = self._selector_cache.get(filter_key)
+        if sel is None:
+            sel = faiss.IDSelectorBatch(allowed)
+            self._selector_cache[filter_key] = sel
+            while len(self._selector_cache) > self._SELECTOR_CACHE_MAX:
+                self._selector_cache.popitem(last=False)
+        else:
+            self._selector_cache.move_to_end(filter_key)
+        return sel
+
+    def __len__(self):
+        return len(self.sources)
+
+    def get_chunk(self, i):
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return bytes(self._blob[start:end]).decode("utf-8")
+
+    def __getitem__(self, i):
+        return {
+            "chunk": self.get_chunk(i),
+            "source": self.sources[i],
+            "page": int(self.pages[i]),
+        }
 
-# ✅ Load embedding model once
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
 
 def load_faiss_and_metadata():
     """
     Load FAISS index + metadata.
     Metadata now includes: chunk, source, page.
+    Prefers the columnar parquet file; falls back to the legacy pickle.
     """
     print("🔄 Loading FAISS index & metadata...")
 
-    faiss_index = faiss.read_index(FAISS_PATH)
+    # mmap the index read-only: zero-copy load, fast cold start, and the
+    # page cache shares the vectors across processes
+    faiss_index = faiss.read_index(
+        FAISS_PATH, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    )
+
+    # GPU fast path: clone the index across available GPUs (faiss-cpu has
+    # no get_num_gpus, hence the hasattr probe); the embedding model already
+    # lands on CUDA via the model registry's device detection. HNSW-family
+    # indexes — the default tier for 1k+ chunk corpora — have no GPU
+    # counterpart, so a failed clone falls back to the CPU index.
+    if hasattr(faiss, "get_num_gpus") and faiss.get_num_gpus() > 0:
+        try:
+            faiss_index = faiss.index_cpu_to_all_gpus(faiss_index)
+        except RuntimeError as e:
+            print(f"⚠ GPU clone failed ({e}), keeping CPU index")
+
+    # For IVF-family indexes, nprobe trades recall for speed at search time;
+    # flat/HNSW indexes have no IVF layer and skip this knob
+    try:
+        faiss.extract_index_ivf(faiss_index).nprobe = int(
+            os.getenv("RAG_NPROBE", 16)
+        )
+    except RuntimeError:
+        pass
 
-    with open(METADATA_PATH, "rb") as f:
-        chunk_metadata = pickle.load(f)
+    if os.path.exists(METADATA_PARQUET_PATH):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(METADATA_PARQUET_PATH, memory_map=True)
+        if os.path.exists(TEXT_BLOB_PATH) and os.path.exists(TEXT_OFFSETS_PATH):
+            # SoA layout: source/page columns + the mmapped text blob
+            chunk_metadata = ChunkMetadata(
+                np.memmap(TEXT_BLOB_PATH, dtype=np.uint8, mode="r"),
+                np.load(TEXT_OFFSETS_PATH, mmap_mode="r"),
+                table.column("source").to_numpy(zero_copy_only=False),
+                table.column("page").to_numpy().astype(np.int32, copy=False),
+            )
+        else:
+            # Older parquet files carry the chunk text inline
+            chunk_metadata = ChunkMetadata.from_records(table.to_pylist())
+    else:
+        with open(METADATA_PATH, "rb") as f:
+            chunk_metadata = ChunkMetadata.from_records(pickle.load(f))
 
     print(f"✅ Loaded FAISS index with {faiss_index.ntotal} vectors")
     return faiss_index, chunk_metadata
 
 
+def _metadata_columns(chunk_metadata):
+    """Returns columnar (sources, pages) NumPy arrays for the metadata."""
+    if isinstance(chunk_metadata, ChunkMetadata):
+        return chunk_metadata.sources, chunk_metadata.pages
+    # Plain list of dicts from an external caller: computed per call. No
+    # module-level cache here — keying one by id() would serve stale arrays
+    # once the address is recycled by a different list.
+    return (
+        np.array([m["source"] for m in chunk_metadata]),
+        np.array([m["page"] for m in chunk_metadata], dtype=np.int32),
+    )
+
+
+def _source_row_ids(chunk_metadata):
+    """Returns the source -> row-id inverted index for the metadata."""
+    if isinstance(chunk_metadata, ChunkMetadata):
+        return chunk_metadata.source_row_ids()
+    sources, _ = _metadata_columns(chunk_metadata)
+    return {
+        name: np.nonzero(sources == name)[0].astype(np.int64, copy=False)
+        for name in np.unique(sources)
+    }
+
+
+def retrieve_top_k_chunks_batch(queries, faiss_index, chunk_metadata, k=3):
+    """
+    Retrieve top-k chunks for a batch of queries in one encoder forward
+    pass and one FAISS search — for offline evals and multi-question
+    requests this amortizes tokenization and kernel launch overhead that
+    a batch-of-1 encode pays per query.
+    Returns one result list per query.
+    """
+    # cached_encode serves repeated queries from the persistent embedding
+    # cache and only runs the model for texts it has never seen
+    query_matrix = cached_encode(queries, batch_size=64)
+    scores, indices = faiss_index.search(query_matrix, k)
+
+    all_results = []
+    for idx_row, score_row in zip(indices, scores):
+        results = []
+        for idx, score in zip(idx_row, score_row):
+            if idx < 0:
+                continue
+            meta = chunk_metadata[idx]
+            results.append({
+                "chunk": meta["chunk"],
+                "source": meta["source"],
+                "page": meta["page"],
+                "score": float(score)
+            })
+        all_results.append(results)
+    return all_results
+
+
 def retrieve_top_k_chunks(query, faiss_index, chunk_metadata, k=3, pdf_name=None, page_range=None):
     """
     Retrieve top-k chunks for a query with optional filtering.
+    - query: a query string, or a pre-computed (normalized) embedding row
     - pdf_name: restrict search to specific PDF
     - page_range: (start_page, end_page) to restrict by pages
     """
-    # ✅ Start with all chunks
-    allowed_indices = list(range(len(chunk_metadata)))
+    # ✅ The common unfiltered string query is just a batch of one
+    if isinstance(query, str) and not pdf_name and not page_range:
+        return retrieve_top_k_chunks_batch(
+            [query], faiss_index, chunk_metadata, k=k
+        )[0]
 
-    # ✅ Filter by PDF name
+    # ✅ Resolve the filters through the per-source inverted index: a PDF
+    # filter is a dict lookup, and a page range only masks that one PDF's
+    # rows instead of rescanning the whole corpus per query
+    _, pages = _metadata_columns(chunk_metadata)
     if pdf_name:
-        allowed_indices = [i for i in allowed_indices if chunk_metadata[i]["source"] == pdf_name]
-
-    # ✅ Filter by page range
-    if page_range:
+        allowed_indices = _source_row_ids(chunk_metadata).get(
+            pdf_name, np.empty(0, dtype=np.int64)
+        )
+        if page_range:
+            start_page, end_page = page_range
+            row_pages = pages[allowed_indices]
+            allowed_indices = allowed_indices[
+                (row_pages >= start_page) & (row_pages <= end_page)
+            ]
+    elif page_range:
         start_page, end_page = page_range
-        allowed_indices = [
-            i for i in allowed_indices
-            if start_page <= chunk_metadata[i]["page"] <= end_page
-        ]
+        allowed_indices = np.nonzero(
+            (pages >= start_page) & (pages <= end_page)
+        )[0]
+    else:
+        allowed_indices = np.arange(len(chunk_metadata))
+
+    # ✅ Encode query (skipped when the caller passes a pre-computed embedding).
+    # The model emits unit-norm vectors directly, so no normalize_L2 pass.
+    if isinstance(query, str):
+        # Already a contiguous unit-norm float32 matrix — no extra cast pass
+        query_embedding = cached_encode([query])
+    else:
+        query_embedding = np.ascontiguousarray(
+            np.atleast_2d(query), dtype=np.float32
+        )
 
-    # ✅ Apply filtering if needed
+    # ✅ Search FAISS, restricting to the allowed ids when a filter applies.
+    # An IDSelector keeps the search inside the existing index — no
+    # reconstruct_n sweep and no temporary per-query IndexFlatIP copy.
     if len(allowed_indices) != len(chunk_metadata):
         print(f"📄 Applying metadata filter: {len(allowed_indices)} chunks remain")
-
-        # Extract ALL vectors from FAISS
-        all_vectors = faiss_index.reconstruct_n(0, faiss_index.ntotal)
-
-        # Filtered vectors + metadata
-        filtered_vectors = np.array([all_vectors[i] for i in allowed_indices])
-        filtered_metadata = [chunk_metadata[i] for i in allowed_indices]
-
-        # Create a temporary FAISS index for filtered subset
-        temp_index = faiss.IndexFlatIP(filtered_vectors.shape[1])
-        temp_index.add(filtered_vectors)
-
-        search_index = temp_index
-        metadata_to_use = filtered_metadata
+        allowed = np.asarray(allowed_indices, dtype=np.int64)
+        try:
+            # Reuse the selector when the same filter repeats — building
+            # IDSelectorBatch hashes every allowed id
+            if isinstance(chunk_metadata, ChunkMetadata):
+                sel = chunk_metadata.selector((pdf_name, page_range), allowed)
+            else:
+                sel = faiss.IDSelectorBatch(allowed)
+            params = faiss.SearchParameters(sel=sel)
+            scores, indices = faiss_index.search(query_embedding, k, params=params)
+        except (AttributeError, RuntimeError):
+            # Index type without selector support: over-retrieve, then
+            # keep the first k hits that pass the filter
+            allowed_set = set(allowed_indices)
+            fetch = min(max(50, 10 * k), faiss_index.ntotal)
+            scores, indices = faiss_index.search(query_embedding, fetch)
+            keep = [
+                col for col, idx in enumerate(indices[0]) if idx in allowed_set
+            ][:k]
+            scores, indices = scores[:, keep], indices[:, keep]
     else:
-        search_index = faiss_index
-        metadata_to_use = chunk_metadata
-
-    # ✅ Encode query
-    query_embedding = embedding_model.encode([query])
-    faiss.normalize_L2(query_embedding)
-
-    # ✅ Search FAISS
-    scores, indices = search_index.search(
-        np.array(query_embedding, dtype="float32"), k
-    )
+        scores, indices = faiss_index.search(query_embedding, k)
 
     results = []
     for idx, score in zip(indices[0], scores[0]):
-        meta = metadata_to_use[idx]
+        if idx < 0:
+            continue  # fewer than k vectors matched the filter
+        meta = chunk_metadata[idx]
         results.append({
             "chunk": meta["chunk"],
             "source": meta["source"],
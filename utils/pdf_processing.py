@@ -13,14 +13,13 @@ def extract_text_from_pdf(pdf_path: str, method: str = "pymupdf") -> str:
         - "pymupdf"  -> fastest, recommended for QA
         - "pdfminer" -> more layout-aware but slower
     """
-    text = ""
-    
     if method == "pymupdf":
-        doc = fitz.open(pdf_path)
-        for page in doc:
-            text += page.get_text()
-        doc.close()
-    
+        # Collect per-page strings and join once — repeated += copies the
+        # accumulated text on every page. The context manager also closes
+        # the document if a page raises mid-extraction.
+        with fitz.open(pdf_path) as doc:
+            text = "".join(page.get_text() for page in doc)
+
     elif method == "pdfminer":
         text = pdfminer_extract_text(pdf_path)
     
@@ -30,44 +29,51 @@ def extract_text_from_pdf(pdf_path: str, method: str = "pymupdf") -> str:
     return text
 
 
+# One compiled pattern replaces the former four re.sub passes (each a full
+# scan over the text). A run may interleave "-\n" hyphenation breaks with
+# ordinary whitespace, so the whole run is matched at once: dropping the
+# "-\n" tokens first and collapsing any leftover whitespace to one space
+# reproduces the old pass order ("-\n" removal, then r"\s+" -> " ", which
+# also flattened the paragraph breaks kept by the middle passes).
+_CLEAN_RE = re.compile(r"(?:-\n|\s)+")
+
+
+def _clean_replacement(match):
+    # Pure hyphenation runs vanish ("exam-\nple" -> "example"); a run with
+    # any other whitespace must still leave exactly one space
+    return "" if match.group().replace("-\n", "") == "" else " "
+
+
 def clean_pdf_text(text: str) -> str:
     """
-    Cleans and normalizes extracted PDF text.
+    Cleans and normalizes extracted PDF text in a single pass.
     - Fix unicode
     - Remove hyphenation at line breaks
-    - Merge single newlines into spaces
-    - Preserve paragraph breaks
-    - Remove extra spaces
+    - Merge line breaks and whitespace runs into single spaces
     """
     text = unicodedata.normalize("NFKC", text)
-    text = re.sub(r"-\n", "", text)          # merge hyphenated words
-    text = re.sub(r"\n{2,}", "\n\n", text)   # keep paragraph breaks
-    text = re.sub(r"(?<!\n)\n(?!\n)", " ", text)  # merge single line breaks
-    text = re.sub(r"\s+", " ", text)         # remove extra spaces
-    return text.strip()
+    return _CLEAN_RE.sub(_clean_replacement, text).strip()
+
+
+# GPT tokenizer — built once at import; get_encoding() is not free and was
+# previously reconstructed on every chunk_text_by_tokens call
+_tokenizer = tiktoken.get_encoding("cl100k_base")
 
 
 def chunk_text_by_tokens(text: str, chunk_size: int = 512, overlap: int = 50):
     """
     Splits cleaned text into overlapping token chunks.
-    
+
     chunk_size: max tokens per chunk
     overlap:    number of tokens overlapped for context
     """
-    tokenizer = tiktoken.get_encoding("cl100k_base")  # GPT tokenizer
-    tokens = tokenizer.encode(text)
-    
-    chunks = []
-    start = 0
-    
-    while start < len(tokens):
-        end = start + chunk_size
-        chunk_tokens = tokens[start:end]
-        chunk_text = tokenizer.decode(chunk_tokens)
-        chunks.append(chunk_text)
-        start += chunk_size - overlap  # sliding window with overlap
-    
-    return chunks
+    tokens = _tokenizer.encode(text)
+
+    # Slice all windows first, then decode them in one decode_batch call —
+    # a single Rust round-trip instead of one per chunk
+    step = chunk_size - overlap  # sliding window with overlap
+    windows = [tokens[start:start + chunk_size] for start in range(0, len(tokens), step)]
+    return _tokenizer.decode_batch(windows)
 
 
 # if __name__ == "__main__":